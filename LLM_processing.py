@@ -1,41 +1,96 @@
+import asyncio
 import base64
-from typing import Optional
+from typing import List, Optional, Tuple, Union
+import blake3
+import diskcache
 from dotenv import load_dotenv
-from openai import OpenAI
-import instructor
-from pydantic import BaseModel, Field
+from openai import AsyncOpenAI, OpenAI
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+
+from vision_preprocess import prepare_vision_image_bytes
 
 # Load environment variables
 load_dotenv()
 
+# Constants
+STAGGER_DELAY = 0.05  # Seconds between the start of concurrent ballot requests
+CACHE_DIR = ".ballot_cache"
+
 ################ LLM OUTPUT SCHEMA ################ 
 class Candidate(BaseModel):
     """Represents a candidate on the ballot."""
+    model_config = ConfigDict(extra='forbid')
+
     name: str = Field(..., description="Name of the candidate")
     position: int = Field(..., description="Position of the candidate on the ballot sheet")
 
 class BallotPaper(BaseModel):
     """Represents the result of analyzing a ballot."""
+    model_config = ConfigDict(extra='forbid')
+
     is_valid: bool = Field(..., description="Indicates whether the ballot is valid")
     validity_explanation: str = Field(..., description="Explanation for why the ballot is valid or invalid")
     uses_cross_or_numbering: bool = Field(..., description="True if the ballot contains a cross or numbering, False otherwise")
-    first_vote: Optional[Candidate] = Field(None, description="Details of the candidate marked as the first preference")
-    second_vote: Optional[Candidate] = Field(None, description="Details of the candidate marked as the second preference")
-    third_vote: Optional[Candidate] = Field(None, description="Details of the candidate marked as the third preference")
+    first_vote: Optional[Candidate] = Field(..., description="Details of the candidate marked as the first preference")
+    second_vote: Optional[Candidate] = Field(..., description="Details of the candidate marked as the second preference")
+    third_vote: Optional[Candidate] = Field(..., description="Details of the candidate marked as the third preference")
+
+# Structured outputs need every field required (nullable instead of defaulted) and no extra keys
+_ADAPTER = TypeAdapter(BallotPaper)
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "BallotPaper", "schema": BallotPaper.model_json_schema(), "strict": True},
+}
 
 ################ LLM PROCESSING ################
 class BallotAnalyzer:
     """Handles the analysis of ballot images using GPT."""
 
-    def __init__(self, model: str = "gpt-4o-mini"):
-        self.client = instructor.patch(OpenAI())
+    def __init__(self, model: str = "gpt-4o-mini", cache_dir: str = CACHE_DIR):
+        self.client = OpenAI()
+        self.async_client = AsyncOpenAI()
         self.model = model
+        self.cache = diskcache.Cache(cache_dir)
+
+    def _cache_key(self, image_bytes: bytes) -> str:
+        """Build the cache key from the image content and the model name."""
+        digest = blake3.blake3(image_bytes).hexdigest()[:32]
+        return f"{self.model}:{digest}"
+
+    def _get_cached(self, key: str) -> Optional[BallotPaper]:
+        """Return the cached analysis for the key, if any."""
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        return _ADAPTER.validate_json(cached)
+
+    def _set_cached(self, key: str, result: BallotPaper) -> None:
+        """Store the analysis for the key."""
+        self.cache[key] = result.model_dump_json()
 
     @staticmethod
-    def _encode_image(image_path: str) -> str:
-        """Encode an image file to base64."""
+    def _read_image(image_path: str) -> bytes:
+        """Read the raw bytes of an image file."""
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return image_file.read()
+
+    @staticmethod
+    def _image_data_url(image_bytes: bytes) -> str:
+        """Crop and downscale the ballot and format it as a base64 JPEG data URL."""
+        jpeg_bytes = prepare_vision_image_bytes(image_bytes)
+        return f"data:image/jpeg;base64,{base64.b64encode(jpeg_bytes).decode('ascii')}"
+
+    def _load_ballot(self, image_path: str) -> Tuple[str, Optional[BallotPaper], Optional[str]]:
+        """Read the ballot once and return its cache key plus either the cached analysis or its data URL.
+
+        The raw file bytes only live for the duration of this call.
+        """
+        image_bytes = self._read_image(image_path)
+        key = self._cache_key(image_bytes)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return key, cached, None
+        return key, None, self._image_data_url(image_bytes)
 
     @staticmethod
     def _get_analysis_prompt() -> str:
@@ -108,25 +163,76 @@ class BallotAnalyzer:
             - Votes: {}
         """
 
+    def _build_messages(self, image_url: str) -> List[dict]:
+        """Build the chat messages for a ballot image data URL."""
+        return [
+            {
+                "role": "system",
+                "content": [{"type": "text", "text": self._get_analysis_prompt()}],
+            },
+            {
+                "role": "user",
+                "content": [{"type": "image_url", "image_url": {"url": image_url, "detail": "low"}}],
+            }
+        ]
+
+    @staticmethod
+    def _parse_response(response, image_path: str) -> BallotPaper:
+        """Parse the structured output of a completion, failing clearly on refusals and truncation."""
+        choice = response.choices[0]
+        if choice.message.refusal:
+            raise RuntimeError(f"Model refused to analyze ballot {image_path}: {choice.message.refusal}")
+        if choice.finish_reason == "length":
+            raise RuntimeError(f"Model output for ballot {image_path} was cut off at max_tokens")
+        return _ADAPTER.validate_json(choice.message.content)
+
     def analyze_ballot(self, image_path: str) -> BallotPaper:
         """Analyze the ballot image and return the result."""
-        base64_image = self._encode_image(image_path)
+        key, cached, image_url = self._load_ballot(image_path)
+        if cached is not None:
+            return cached
         
-        return self.client.chat.completions.create(
+        response = self.client.chat.completions.create(
                 model = self.model,
-                response_model = BallotPaper,
-                messages = [
-                    {
-                        "role": "system",
-                        "content": [{"type": "text", "text": self._get_analysis_prompt()}],
-                    },
-                    {
-                        "role": "user",
-                        "content": [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}],
-                    }
-                ],
+                response_format = _RESPONSE_FORMAT,
+                messages = self._build_messages(image_url),
                 max_tokens = 1000,
                 )
+        result = self._parse_response(response, image_path)
+        self._set_cached(key, result)
+        return result
+
+    async def _analyze_one(self, image_path: str, semaphore: asyncio.Semaphore, delay: float) -> BallotPaper:
+        """Analyze a single ballot image once a concurrency slot is free."""
+        # Stagger the start so the image encoding of concurrent requests does not run in lockstep
+        await asyncio.sleep(delay)
+        async with semaphore:
+            # Reading, hashing, the cache lookup and encoding all block, and happen inside the
+            # semaphore so at most `concurrency` ballots are held in memory at once
+            key, cached, image_url = await asyncio.to_thread(self._load_ballot, image_path)
+            if cached is not None:
+                return cached
+            response = await self.async_client.chat.completions.create(
+                    model = self.model,
+                    response_format = _RESPONSE_FORMAT,
+                    messages = self._build_messages(image_url),
+                    max_tokens = 1000,
+                    )
+        result = self._parse_response(response, image_path)
+        await asyncio.to_thread(self._set_cached, key, result)
+        return result
+
+    async def analyze_ballots(self, image_paths: List[str], concurrency: int = 10) -> List[Union[BallotPaper, Exception]]:
+        """Analyze several ballot images concurrently, returning results in input order.
+
+        A ballot that fails (rate limit, timeout, unreadable image, ...) does not
+        fail the batch: its slot holds the raised exception instead of a BallotPaper.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[
+            self._analyze_one(path, semaphore, (i % concurrency) * STAGGER_DELAY)
+            for i, path in enumerate(image_paths)
+        ], return_exceptions=True)
 
 def main():
     image_path = "sample_ballot_papers/vote_1.png"
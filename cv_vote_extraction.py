@@ -16,11 +16,22 @@ CONTOUR_COLOR = (0, 255, 0)
 RECT_COLOR = (0, 255, 255)
 LINE_COLOR = (36, 255, 12)
 
+def cuda_available():
+    """Check whether OpenCV was built with CUDA and a device is present."""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
 # Utility class for image operations
 class ImageProcessor:
-    def __init__(self, template_dir, threshold=THRESHOLD):
+    def __init__(self, template_dir, threshold=THRESHOLD, use_cuda=None):
         self.templates = self._load_templates(template_dir)
         self.threshold = threshold
+        self.use_cuda = cuda_available() if use_cuda is None else use_cuda
+        if self.use_cuda:
+            self.matcher = cv2.cuda.createTemplateMatching(cv2.CV_8UC1, cv2.TM_CCOEFF_NORMED)
+            self.stream = cv2.cuda.Stream()
 
     def _load_templates(self, template_dir):
         """Load template images for symbol matching."""
@@ -29,24 +40,42 @@ class ImageProcessor:
             if filename.endswith('.png'):
                 symbol = filename.split('.')[0]
                 template = cv2.imread(os.path.join(template_dir, filename), 0)
-                templates[symbol] = template
+                # Stored as float32 so matchTemplate does not convert them on every call
+                templates[symbol] = {'orig': template.astype(np.float32), 'scaled_cache': {}, 'gpu_cache': {}}
         return templates
 
-    def identify_symbol(self, image):
-        """Identify the symbol in the given image using template matching."""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        best_match = None
-        best_val = -np.inf
-        
-        for symbol, template in self.templates.items():
-            if template.shape[0] > image.shape[0] or template.shape[1] > image.shape[1]:
-                scale = min(image.shape[0] / template.shape[0], image.shape[1] / template.shape[1])
+    @staticmethod
+    def _get_template(entry, image_shape):
+        """Return the template fitted to the image size, resizing it at most once per size."""
+        bucket = image_shape[:2]
+        template = entry['scaled_cache'].get(bucket)
+        if template is None:
+            template = entry['orig']
+            if template.shape[0] > bucket[0] or template.shape[1] > bucket[1]:
+                scale = min(bucket[0] / template.shape[0], bucket[1] / template.shape[1])
                 new_size = (int(template.shape[1] * scale), int(template.shape[0] * scale))
                 template = cv2.resize(template, new_size, interpolation=cv2.INTER_AREA)
+            entry['scaled_cache'][bucket] = template
+        return template
 
-            result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
-            _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    def _get_gpu_template(self, entry, image_shape):
+        """Return the fitted template as a uint8 GpuMat, uploading it at most once per size."""
+        bucket = image_shape[:2]
+        g_template = entry['gpu_cache'].get(bucket)
+        if g_template is None:
+            # The CUDA matcher only supports TM_CCOEFF_NORMED on 8-bit images
+            template = np.clip(np.rint(self._get_template(entry, bucket)), 0, 255).astype(np.uint8)
+            g_template = cv2.cuda_GpuMat()
+            g_template.upload(template)
+            entry['gpu_cache'][bucket] = g_template
+        return g_template
 
+    def _select_best(self, scores):
+        """Pick the best (symbol, max_val, max_loc) score above the threshold."""
+        best_match = None
+        best_val = -np.inf
+
+        for symbol, max_val, max_loc in scores:
             if max_val > best_val and max_val > self.threshold:
                 best_match = symbol
                 best_val = max_val
@@ -57,6 +86,51 @@ class ImageProcessor:
         else:
             return "Unknown", None, None
 
+    def identify_symbol(self, gray_image):
+        """Identify the symbol in the given grayscale image using template matching."""
+        # Convert once per image instead of letting matchTemplate do it per template
+        gray = gray_image.astype(np.float32)
+        scores = []
+
+        for symbol, entry in self.templates.items():
+            template = self._get_template(entry, gray.shape)
+            result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(result)
+            scores.append((symbol, max_val, max_loc))
+
+        return self._select_best(scores)
+
+    def identify_symbols(self, gray_image, row_bounds):
+        """Identify the symbol in each (y1, y2) row of the grayscale image.
+
+        With CUDA the page is uploaded once and every row and template is matched
+        on the GPU stream; otherwise each row is matched on the CPU.
+        """
+        if not self.use_cuda:
+            return [self.identify_symbol(gray_image[y1:y2]) for y1, y2 in row_bounds]
+
+        g_page = cv2.cuda_GpuMat()
+        g_page.upload(gray_image)
+        width = gray_image.shape[1]
+
+        pending = []
+        for y1, y2 in row_bounds:
+            g_row = cv2.cuda_GpuMat(g_page, (0, y1, width, y2 - y1))
+            pending.append([
+                (symbol, self.matcher.match(g_row, self._get_gpu_template(entry, (y2 - y1, width)), stream=self.stream))
+                for symbol, entry in self.templates.items()
+            ])
+        self.stream.waitForCompletion()
+
+        results = []
+        for row_results in pending:
+            scores = []
+            for symbol, g_result in row_results:
+                _, max_val, _, max_loc = cv2.cuda.minMaxLoc(g_result)
+                scores.append((symbol, max_val, max_loc))
+            results.append(self._select_best(scores))
+        return results
+
 # Function to process the image and detect horizontal lines
 def detect_horizontal_lines(image):
     """Detect horizontal lines in the warped binary image."""
@@ -64,34 +138,30 @@ def detect_horizontal_lines(image):
     detect_horizontal = cv2.morphologyEx(image, cv2.MORPH_OPEN, horizontal_kernel, iterations=2)
     contours, _ = cv2.findContours(detect_horizontal, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    horizontal_lines = []
-    for contour in contours:
-        x, y, w, h = cv2.boundingRect(contour)
-        if w > MIN_LINE_WIDTH:
-            horizontal_lines.append((x, y, x + w, y + h))
-    return horizontal_lines
+    # Bounding boxes as one (N, 4) array so the width filter runs vectorized
+    rects = np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.int32).reshape(-1, 4)
+    rects = rects[rects[:, 2] > MIN_LINE_WIDTH]
+    rects[:, 2:] += rects[:, :2]  # (x, y, w, h) -> (x1, y1, x2, y2)
+    return [tuple(line) for line in rects.tolist()]
+
+# Function to find the row bounds between detected lines
+def get_row_bounds(lines, height):
+    """Return the (y1, y2) bounds of the rows between the horizontal lines."""
+    lines.sort(key=lambda line: line[1])  # Sort by y-coordinate
+    y_coords = [0] + [line[1] for line in lines] + [height]
+    return [(y_coords[i], y_coords[i + 1]) for i in range(len(y_coords) - 1)]
 
 # Function to divide the image based on detected lines
 def divide_image_by_lines(image, lines):
     """Divide the image into sub-images based on the provided horizontal lines."""
-    lines.sort(key=lambda line: line[1])  # Sort by y-coordinate
     height, width = image.shape[:2]
-    lines = [(0, 0, width, 0)] + lines + [(0, height, width, height)]
-
-    sub_images = []
-    for i in range(len(lines) - 1):
-        y1 = lines[i][1]
-        y2 = lines[i + 1][1]
-        sub_image = image[y1:y2, 0:width]
-        sub_images.append(sub_image)
-    return sub_images
+    return [image[y1:y2, 0:width] for y1, y2 in get_row_bounds(lines, height)]
 
-# Function to process and warp the perspective of the image
-def process_image(image_path):
-    """Read, resize, and process the image for further operations."""
-    img = cv2.imread(image_path)
-    img_resized = cv2.resize(img, RESIZE_DIM)
-    img_gray = cv2.cvtColor(img_resized, cv2.COLOR_BGR2GRAY)
+# Function to build the edge threshold image used for contour detection
+def create_threshold_image(img):
+    """Convert the image to grayscale and build its dilated edge map."""
+    # UMat keeps the intermediate images on the OpenCL device (T-API) when one is available
+    img_gray = cv2.cvtColor(cv2.UMat(img), cv2.COLOR_BGR2GRAY)
     img_blur = cv2.GaussianBlur(img_gray, GAUSSIAN_BLUR_KERNEL, 1)
     img_edges = cv2.Canny(img_blur, *CANNY_THRESH)
     
@@ -99,24 +169,53 @@ def process_image(image_path):
     img_dilated = cv2.dilate(img_edges, kernel, iterations=2)
     img_threshold = cv2.erode(img_dilated, kernel, iterations=1)
 
+    return img_gray.get(), img_threshold.get()
+
+# Function to process and warp the perspective of the image
+def process_image(image_path):
+    """Read, resize, and process the image for further operations."""
+    img_resized = cv2.resize(cv2.imread(image_path), RESIZE_DIM)
+    img_gray, img_threshold = create_threshold_image(img_resized)
+
     return img_resized, img_threshold, img_gray
 
-# Function to find and warp the largest contour
-def warp_perspective(image, threshold_image):
-    """Find the largest contour and warp the perspective of the image."""
+# Function to find the bounding box of the ballot
+def find_ballot_bbox(threshold_image):
+    """Return the bounding box (x, y, w, h) of the largest contour, or None if there are none."""
     contours, _ = cv2.findContours(threshold_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
     contour_areas = [cv2.contourArea(c) for c in contours]
     max_area_contour = contours[np.argmax(contour_areas)]
+    return cv2.boundingRect(max_area_contour)
+
+# Function to crop the image to the ballot paper
+def crop_to_ballot(image):
+    """Crop the image to the bounding box of the ballot paper, keeping its resolution."""
+    _, img_threshold = create_threshold_image(image)
+    bbox = find_ballot_bbox(img_threshold)
+    # A blank or overexposed scan has no edges to crop to, so send it as is
+    if bbox is None:
+        return image
+    x, y, w, h = bbox
+    return image[y:y + h, x:x + w]
 
-    x, y, w, h = cv2.boundingRect(max_area_contour)
+# Function to find and warp the largest contour
+def warp_perspective(image, threshold_image, gray_image):
+    """Find the largest contour and warp the perspective of the color, binary and gray images."""
+    bbox = find_ballot_bbox(threshold_image)
+    if bbox is None:
+        raise ValueError("No ballot contour found to warp")
+    x, y, w, h = bbox
     pts1 = np.float32([[x, y], [x + w, y], [x, y + h], [x + w, y + h]])
     pts2 = np.float32([[0, 0], [RESIZE_DIM[0], 0], [0, RESIZE_DIM[1]], [RESIZE_DIM[0], RESIZE_DIM[1]]])
     matrix = cv2.getPerspectiveTransform(pts1, pts2)
 
     img_warped = cv2.warpPerspective(image, matrix, RESIZE_DIM)
     img_warped_bw = cv2.warpPerspective(threshold_image, matrix, RESIZE_DIM)
+    img_warped_gray = cv2.warpPerspective(gray_image, matrix, RESIZE_DIM)
 
-    return img_warped, img_warped_bw
+    return img_warped, img_warped_bw, img_warped_gray
 
 def main():
     # Load and process the image
@@ -124,25 +223,23 @@ def main():
     img_resized, img_threshold, img_gray = process_image(image_path)
     
     # Warp perspective
-    img_warped, img_warped_bw = warp_perspective(img_resized, img_threshold)
+    img_warped, img_warped_bw, img_warped_gray = warp_perspective(img_resized, img_threshold, img_gray)
     
     # Detect horizontal lines
     horizontal_lines = detect_horizontal_lines(img_warped_bw)
 
-    # Divide image into sub-images
-    extracted_img_rows = divide_image_by_lines(img_warped, horizontal_lines)
+    # Find the rows between the lines, skipping slivers too small to hold a symbol
+    height, width = img_warped_gray.shape[:2]
+    row_bounds = [(y1, y2) for y1, y2 in get_row_bounds(horizontal_lines, height)
+                  if y2 - y1 > 40 and width > 40]
 
-    # Initialize symbol matcher and process each row
+    # Initialize symbol matcher and process all rows
     processor = ImageProcessor(TEMPLATE_DIR)
     vote_dict = {}
-    row = 0
-
-    for img_row in extracted_img_rows:
-        if img_row.shape[0] > 40 and img_row.shape[1] > 40:
-            row += 1
-            symbol, location, confidence = processor.identify_symbol(img_row)
-            vote_dict[row] = symbol
-            print(f"Row {row}: {symbol}, {location}, {confidence}")
+
+    for row, (symbol, location, confidence) in enumerate(processor.identify_symbols(img_warped_gray, row_bounds), start=1):
+        vote_dict[row] = symbol
+        print(f"Row {row}: {symbol}, {location}, {confidence}")
 
 
     # Display results
@@ -1,6 +1,9 @@
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
+import blake3
+import diskcache
 from dotenv import load_dotenv
 from unstract.llmwhisperer.client import LLMWhispererClient, LLMWhispererClientException
 
@@ -16,17 +19,30 @@ CANDIDATE_NAMES = [
     'MANUJA WIJESINGHE', 'ISURU KARUNARATNE'
 ]
 NAME_END_POSITION = 20  # Assumed position where candidate name ends in the ballot line
+MAX_WHISPER_WORKERS = 8  # Concurrent LLMWhisperer requests in batch processing
+OCR_CACHE_DIR = ".ocr_cache"
+# Candidate names without whitespace, for matching against OCR text
+_PROCESSED_NAMES = tuple(''.join(name.split()).upper() for name in CANDIDATE_NAMES)
+_NAME_BY_PROCESSED = dict(zip(_PROCESSED_NAMES, CANDIDATE_NAMES))
+_VOTE_RE = re.compile('[' + re.escape(''.join(VALID_VOTES)) + ']')
 
 class LayoutProcessor:
     """Handles the conversion of PDF documents to structured text."""
-    def __init__(self):
+    def __init__(self, cache_dir: str = OCR_CACHE_DIR):
         load_dotenv()
         api_key = os.getenv('LLMWHISPER_API_KEY')
         base_url = os.getenv('LLMWHISPER_BASE_URL')
         self.client = LLMWhispererClient(base_url=base_url, api_key=api_key, logging_level="INFO")
+        self.cache = diskcache.Cache(cache_dir)
 
     def img_to_structured_text(self, pdf_path: str) -> str:
-        """Convert a PDF file to structured text using LLMWhisperer."""
+        """Convert a PDF file to structured text using LLMWhisperer, reusing cached results."""
+        with open(pdf_path, 'rb') as pdf_file:
+            key = blake3.blake3(pdf_file.read()).hexdigest()[:32]
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
             result = self.client.whisper(
                 file_path=pdf_path,
@@ -36,6 +52,8 @@ class LayoutProcessor:
                 line_splitter_tolerance=0.4,
                 horizontal_stretch_factor=1.2
             )
+            # Only successful conversions are cached so failures are retried
+            self.cache[key] = result["extracted_text"]
             return result["extracted_text"]
         except LLMWhispererClientException as e:
             return f'PDF conversion failed with error: {e}'
@@ -46,19 +64,16 @@ class VoteExtractor:
     def extract_vote(line: str) -> Optional[str]:
         """Extract a valid vote from a line of text."""
         line = line.replace('[X]', '')
-        for char in line:
-            if char in VALID_VOTES:
-                return char
-        return None
+        match = _VOTE_RE.search(line)
+        return match.group(0) if match else None
 
     @staticmethod
     def extract_candidate_name(text: str) -> Optional[str]:
         """Extract a candidate name from a line of text."""
-        processed_names = [''.join(name.split()).upper() for name in CANDIDATE_NAMES]
         processed_input = ''.join(text.split()).upper()
-        for i, processed_name in enumerate(processed_names):
+        for processed_name in _PROCESSED_NAMES:
             if processed_name in processed_input:
-                return CANDIDATE_NAMES[i]
+                return _NAME_BY_PROCESSED[processed_name]
         return None
 
 class VotingSystem:
@@ -70,7 +85,27 @@ class VotingSystem:
     def process_votes(self) -> List[Dict[str, Optional[str]]]:
         """Process the votes from the PDF ballot."""
         extracted_text = self.pdf_processor.img_to_structured_text(self.pdf_path)
+        return self._extract_votes(extracted_text)
+
+    def process_votes_batch(self, pdf_paths: List[str], max_workers: int = MAX_WHISPER_WORKERS) -> List[List[Dict[str, Optional[str]]]]:
+        """Process several PDF ballots, running the LLMWhisperer requests concurrently."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            extracted_texts = list(executor.map(self.pdf_processor.img_to_structured_text, pdf_paths))
+        # Parsing is cheap, so it stays sequential
+        return [self._extract_votes(extracted_text) for extracted_text in extracted_texts]
+
+    @staticmethod
+    def _extract_votes(extracted_text: str) -> List[Dict[str, Optional[str]]]:
+        """Extract the candidate votes from the structured text of a ballot."""
         lines = [line.strip() for line in extracted_text.split('\n')]
+        # Most lines have no candidate, so votes are only extracted for lines next to one;
+        # a line shared by neighbouring candidates is still only scanned once
+        line_votes = {}
+
+        def vote_at(index: int) -> Optional[str]:
+            if index not in line_votes:
+                line_votes[index] = VoteExtractor.extract_vote(lines[index][NAME_END_POSITION:])
+            return line_votes[index]
         
         vote_dict = []
         candidate_list_index = 0
@@ -79,10 +114,9 @@ class VotingSystem:
             candidate_name = VoteExtractor.extract_candidate_name(line)
             if candidate_name:
                 # Try to extract vote from current line, then previous, then next
-                vote = VoteExtractor.extract_vote(line[NAME_END_POSITION:])
+                vote = vote_at(i)
                 if vote is None:
-                    vote = VoteExtractor.extract_vote(lines[i-1][NAME_END_POSITION:]) or \
-                           VoteExtractor.extract_vote(lines[i+1][NAME_END_POSITION:])
+                    vote = vote_at(i-1) or vote_at(i+1)
                 
                 candidate_list_index += 1
                 record = {
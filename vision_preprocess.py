@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+
+from cv_vote_extraction import crop_to_ballot
+
+# Constants
+MAX_IMAGE_EDGE = 1024  # Longest edge (px) of the image sent to the vision model
+JPEG_QUALITY = 80
+
+def prepare_vision_image(image_path: str, max_edge: int = MAX_IMAGE_EDGE, quality: int = JPEG_QUALITY, crop: bool = True) -> bytes:
+    """Decode, crop and downscale an image file and return it as JPEG bytes for a vision model."""
+    with open(image_path, "rb") as image_file:
+        return prepare_vision_image_bytes(image_file.read(), max_edge, quality, crop)
+
+def prepare_vision_image_bytes(image_bytes: bytes, max_edge: int = MAX_IMAGE_EDGE, quality: int = JPEG_QUALITY, crop: bool = True) -> bytes:
+    """Decode, crop and downscale encoded image bytes and return them as JPEG bytes for a vision model."""
+    # IMREAD_COLOR drops any alpha channel
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+
+    if crop:
+        img = crop_to_ballot(img)
+
+    h, w = img.shape[:2]
+    if max(h, w) > max_edge:
+        scale = max_edge / max(h, w)
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
@@ -1,3 +1,4 @@
+from collections import Counter
 from typing import List, Dict, Optional
 
 class VoteValidator:
@@ -7,6 +8,8 @@ class VoteValidator:
         self.valid_vote_characters = valid_vote_characters
         self.valid_vote_numbers = valid_vote_numbers
         self.valid_votes = valid_vote_characters + valid_vote_numbers
+        self._valid_vote_set = set(self.valid_votes)
+        self._number_counts = Counter(valid_vote_numbers)
 
     def is_valid(self, votes: List[Dict[str, Optional[str]]]) -> bool:
         """
@@ -18,11 +21,13 @@ class VoteValidator:
         if not extracted_votes:
             return False
         
+        vote_counts = Counter(extracted_votes)
+
         # 2. Check only for valid characters
-        if any(vote not in self.valid_votes for vote in extracted_votes):
+        if not vote_counts.keys() <= self._valid_vote_set:
             return False
         
-        x_count = sum(extracted_votes.count(char) for char in self.valid_vote_characters)
+        x_count = sum(vote_counts[char] for char in self.valid_vote_characters)
         
         # 3. If 'X' there should not be any characters
         if x_count > 1 or (x_count == 1 and len(extracted_votes) != 1):
@@ -30,8 +35,8 @@ class VoteValidator:
         
         # 4. Check for valid numbered voting
         if x_count == 0:
-            if all(vote in self.valid_vote_numbers for vote in extracted_votes):
-                if sorted(extracted_votes) != self.valid_vote_numbers:
+            if vote_counts.keys() <= self._number_counts.keys():
+                if vote_counts != self._number_counts:
                     return False
             else:
                 return False
@@ -1,94 +1,118 @@
 import cv2
+import numpy as np
+import torch
 from ultralytics import YOLO
 
 YOLO_MODEL_PATH = "yolo_vote_detection_model.pt"
 VOTE_SYMBOLS = ['cross' ,'1', '2', '3']
 POSITION_TOLERANCE = 20
+IMAGE_SIZE = 640
+BATCH_SIZE = 16  # Images per forward pass; tune to the available GPU memory
 
 class YOLOProcessor:
     def __init__(self, model_path):
-        # Load a pretrained YOLOv8n model
+        # Load a pretrained YOLOv8n model and fuse its Conv+BN layers once up front
         self.model = YOLO(model_path)
+        self.model.fuse()
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # FP16 only pays off (and is only supported) on the GPU
+        self.half = self.device == 'cuda'
 
     def run_inference(self, source_image):
-        """Run inference on the source image and return the results."""
-        return self.model(source_image)
+        """Run inference on the source image (or a list of images) and return the results."""
+        return self.model(source_image, device=self.device, half=self.half, imgsz=IMAGE_SIZE)
+
+    def run_inference_batch(self, source_images, batch_size=BATCH_SIZE):
+        """Run batched inference on a list of images and return one result per image."""
+        results = []
+        for start in range(0, len(source_images), batch_size):
+            results.extend(self.run_inference(source_images[start:start + batch_size]))
+        return results
 
 class VoteProcessor:
     def __init__(self, result):
         self.result = result
         self.class_dict = self.result.names
+        # Copy all boxes and classes off the device once instead of per box
+        self.boxes = self.result.boxes.xyxy.cpu().numpy().reshape(-1, 4)
+        self.classes = self.result.boxes.cls.cpu().numpy().astype(int)
+        self.symbol_mask = np.isin(self.classes, [cls for cls, name in self.class_dict.items() if name in VOTE_SYMBOLS])
         self.vote_symbol_dict = self._extract_vote_symbols()
 
     def _extract_vote_symbols(self):
         """Extracts the positions of symbols that are not the 'name' class."""
-        return {self.class_dict[int(box.cls.item())]: box.xyxy.cpu().numpy()
-                for box in self.result.boxes
-                if self.class_dict[int(box.cls.item())] in VOTE_SYMBOLS}
-
-
-    def _check_for_vote(self, name_pos, index):
-        """Check for the closest vote symbol to the name position."""
-        for symbol, symbol_pos in self.vote_symbol_dict.items():
-            name_y1 = name_pos[0][1]
-            name_y2 = name_pos[0][3]
-
-            # Case 1: Name starts within the symbol bounds
-            if name_y1 >= symbol_pos[0][1] and name_y1 <= symbol_pos[0][3]:
-                return (index, symbol)
-            
-            # Case 2: Name fully overlaps the symbol
-            elif name_y1 <= symbol_pos[0][1] and name_y2 >= symbol_pos[0][3]:
-                return (index, symbol)
-
-            # Case 3: Vote symbol at top of the name
-            elif abs(name_y1 - symbol_pos[0][3]) < POSITION_TOLERANCE:
-                return (index, symbol)
-
-            # Case 4: Vote symbol at bottom of the name
-            elif abs(symbol_pos[0][1] - name_y2) < POSITION_TOLERANCE:
-                return (index, symbol)
-        return None
+        return {self.class_dict[cls]: box
+                for cls, box in zip(self.classes[self.symbol_mask], self.boxes[self.symbol_mask])}
+
+
+    def _match_votes(self, name_boxes):
+        """Return a (names x symbols) boolean matrix of names that match each vote symbol."""
+        symbol_boxes = np.array(list(self.vote_symbol_dict.values())).reshape(-1, 4)
+        name_y1 = name_boxes[:, None, 1]
+        name_y2 = name_boxes[:, None, 3]
+        symbol_y1 = symbol_boxes[None, :, 1]
+        symbol_y2 = symbol_boxes[None, :, 3]
+
+        # Case 1: Name starts within the symbol bounds
+        starts_within = (name_y1 >= symbol_y1) & (name_y1 <= symbol_y2)
+
+        # Case 2: Name fully overlaps the symbol
+        overlaps = (name_y1 <= symbol_y1) & (name_y2 >= symbol_y2)
+
+        # Case 3: Vote symbol at top of the name
+        symbol_above = np.abs(name_y1 - symbol_y2) < POSITION_TOLERANCE
+
+        # Case 4: Vote symbol at bottom of the name
+        symbol_below = np.abs(symbol_y1 - name_y2) < POSITION_TOLERANCE
+
+        return starts_within | overlaps | symbol_above | symbol_below
     
     def find_names_and_votes(self):
         """Finds the relationship between name positions and vote symbols."""
         names_and_votes = []
+        symbols = list(self.vote_symbol_dict)
+        name_indices = np.flatnonzero(~self.symbol_mask)
+
+        matches = self._match_votes(self.boxes[name_indices])
+        has_vote = matches.any(axis=1)
+        # The first matching symbol wins, as in the symbol dictionary order
+        first_match = matches.argmax(axis=1) if symbols else np.zeros(len(name_indices), dtype=int)
 
-        for i, box in enumerate(self.result.boxes):
-            class_name = self.class_dict[int(box.cls.item())]
-            if class_name not in VOTE_SYMBOLS:
-                name_position = box.xyxy.cpu().numpy()
-                associated_vote = self._check_for_vote(name_position, i)
-                print(i, class_name, associated_vote)
-                if associated_vote:
-                    names_and_votes.append(associated_vote)
+        for row, i in enumerate(name_indices):
+            class_name = self.class_dict[self.classes[i]]
+            associated_vote = (int(i), symbols[first_match[row]]) if has_vote[row] else None
+            print(i, class_name, associated_vote)
+            if associated_vote:
+                names_and_votes.append(associated_vote)
 
         return names_and_votes
 
 def main():
-    # Initialize YOLO processor and read the image
+    # Initialize YOLO processor and read the images
     yolo_processor = YOLOProcessor(YOLO_MODEL_PATH)
 
-    image_path = r'sample_ballot_papers/vote_5.png'
-    source_image = cv2.imread(image_path)
+    image_paths = [r'sample_ballot_papers/vote_5.png']
+    source_images = [cv2.imread(image_path) for image_path in image_paths]
 
-    # Run inference on the image
-    result = yolo_processor.run_inference(source_image)[0]
+    # Run batched inference on the images
+    results = yolo_processor.run_inference_batch(source_images)
 
     # Process vote and name positions
-    vote_processor = VoteProcessor(result)
-    names_and_votes = vote_processor.find_names_and_votes()
-
-    # Output the results
-    print("="*25)
-    print(names_and_votes)
-    print("="*25)
-
-    # Visualize the results
-    annotated_frame = result.plot()
-    cv2.imshow("YOLOv8 Inference", annotated_frame)
-    if cv2.waitKey(0) & 0xFF == ord("q"):
-        cv2.destroyAllWindows()
+    vote_processors = [VoteProcessor(result) for result in results]
+
+    for result, vote_processor in zip(results, vote_processors):
+        names_and_votes = vote_processor.find_names_and_votes()
+
+        # Output the results
+        print("="*25)
+        print(names_and_votes)
+        print("="*25)
+
+        # Visualize the results
+        annotated_frame = result.plot()
+        cv2.imshow("YOLOv8 Inference", annotated_frame)
+        if cv2.waitKey(0) & 0xFF == ord("q"):
+            cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":